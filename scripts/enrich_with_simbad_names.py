@@ -1,96 +1,222 @@
 import argparse
-import json
-import os
+import asyncio
+import re
+import sqlite3
 import time
 from pathlib import Path
-from astroquery.simbad import Simbad
-from tqdm import tqdm
 
-# configure extra fields
-Simbad.reset_votable_fields()
-Simbad.add_votable_fields("ids")      # other cross-identifications
-Simbad.add_votable_fields("main_id")  # canonical name
+import aiohttp
+import orjson
+from tenacity import retry, stop_after_attempt, wait_exponential
+from yarl import URL
+
+# SIMBAD TAP synchronous endpoint (ADQL over HTTP POST); parsed once
+TAP_URL = URL("https://simbad.u-strasbg.fr/simbad/sim-tap/sync")
+TAP_FORM = {"REQUEST": "doQuery", "LANG": "ADQL", "FORMAT": "json"}
+ADQL_TEMPLATE = (
+    "SELECT ident.id, basic.main_id, ids.ids "
+    "FROM ident "
+    "JOIN basic ON ident.oidref = basic.oid "
+    "JOIN ids ON ids.oidref = basic.oid "
+    "WHERE ident.id IN ({names})"
+)
 
 # safe defaults
 BATCH_SIZE = 50
-DELAY_S = 1.0   # seconds between batches
+CONCURRENCY = 8  # batches in flight at once
+DELAY_S = 1.0   # seconds each worker waits after a batch
 RETRIES = 3
 RETRY_DELAY = 3.0
 
-def load_cache(path: Path):
-    if path.exists():
-        try:
-            return json.loads(path.read_text(encoding="utf8"))
-        except Exception:
-            return {}
-    return {}
+HIP_RE = re.compile(r"^HIP\s*(\d+)$", re.I)
 
-def save_cache(path: Path, cache):
+def open_cache(path: Path):
+    """
+    Open (creating if needed) the SQLite name cache: one row per HIP, so runs
+    read the cached keys once and append newly queried batches. A legacy
+    names_cache.json path maps to its .sqlite sibling.
+    """
+    if path.suffix == ".json":
+        path = path.with_suffix(".sqlite")
+        print("Using SQLite cache:", path)
     path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(cache, indent=2, ensure_ascii=False), encoding="utf8")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS simbad(hip INTEGER PRIMARY KEY, main_id TEXT, ids TEXT)")
+    # one-off import of the old monolithic names_cache.json, if present
+    legacy = path.with_suffix(".json")
+    if legacy.exists() and conn.execute("SELECT COUNT(*) FROM simbad").fetchone()[0] == 0:
+        try:
+            entries = trusted_legacy_entries(orjson.loads(legacy.read_bytes()))
+            store_cache(conn, entries)
+            print(f"Imported {len(entries)} verified entries from legacy cache:", legacy)
+        except Exception as e:
+            print(f"Could not import legacy cache {legacy}: {e}")
+    return conn
 
-def query_simbad_for_hips(hip_list):
+def trusted_legacy_entries(legacy):
     """
-    Query Simbad for a list of 'HIP <id>' strings.
-    Returns dict mapping 'HIP:<id>' -> {'main_id':..., 'ids':[...] }
+    Filter the old JSON cache, which pinned rows it couldn't attribute onto the
+    first HIP of their batch: keep an entry only if its own IDS list contains
+    that HIP. Everything else (including cached misses) is queried again.
     """
-    # Simbad.query_objects accepts object names like "HIP 123"
-    qnames = [f"HIP {int(h)}" for h in hip_list]
-    for attempt in range(1, RETRIES+1):
+    out = {}
+    for key, v in legacy.items():
         try:
-            result = Simbad.query_objects(qnames)
-            # result may be None or a table
-            out = {}
-            if result is None:
-                return out
-            for row in result:
-                # Simbad returns MAIN_ID and IDS columns
-                main = row.get("MAIN_ID")
-                ids_raw = row.get("IDS")
-                # Some rows may not have 'IDS'; normalize
-                ids_list = []
-                if ids_raw is not None:
-                    # IDS often a string like 'HD 48915;HIP 32349;...'
-                    ids_list = [s.strip() for s in str(ids_raw).split("|") if s.strip()] if "|" in str(ids_raw) else [s.strip() for s in str(ids_raw).split(";") if s.strip()]
-                # find HIP id in ids_list or from qnames
-                # normalize key to HIP:<n>
-                hip_key = None
-                # try to find HIP n in ids
-                for token in ids_list:
-                    tok = token.replace(" ", "")
-                    if tok.upper().startswith("HIP"):
-                        try:
-                            hip_key = f"HIP:{int(tok[3:])}"
-                            break
-                        except:
-                            pass
-                # if not found, attempt to parse main string for HIP N
-                if hip_key is None:
-                    # try to match from original qnames: first token "HIP N"
-                    # but astroquery result doesn't include original query; find best match by parsing ids again
-                    hip_key = None
-                out[hip_key or f"HIP:UNKNOWN"] = {
-                    "main_id": str(main) if main is not None else None,
-                    "ids": ids_list
-                }
-            return out
-        except Exception as e:
-            print(f"SIMBAD query attempt {attempt} failed: {e}")
-            if attempt < RETRIES:
-                time.sleep(RETRY_DELAY)
-            else:
-                raise
-    return {}
+            hip = int(key[4:])
+        except ValueError:
+            continue
+        if hip in {extract_hip(x) for x in (v or {}).get("ids") or []}:
+            out[key] = v
+    return out
+
+def store_cache(conn, entries):
+    """Insert/replace {'HIP:<id>': {'main_id':..., 'ids':[...]}} in one transaction."""
+    rows = []
+    for key, v in entries.items():
+        try:
+            hip = int(key[4:])
+        except ValueError:
+            continue
+        rows.append((hip, v.get("main_id"), orjson.dumps(v.get("ids") or []).decode()))
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO simbad(hip, main_id, ids) VALUES (?, ?, ?)", rows)
+
+def extract_hip(ident):
+    """HIP number from an identifier like 'HIP 32349' (None if it isn't one)."""
+    if not ident:
+        return None
+    m = HIP_RE.fullmatch(str(ident).strip())
+    return int(m.group(1)) if m else None
+
+def split_ids(ids_raw):
+    """SIMBAD IDS string ('HD 48915|HIP 32349|...', or ';'-separated) -> list."""
+    if ids_raw is None:
+        return []
+    return [t.strip() for t in str(ids_raw).replace(";", "|").split("|") if t.strip()]
+
+def pick_name(main_id, ids):
+    """Display name: MAIN_ID, else the first non-HIP identifier."""
+    if main_id:
+        return main_id
+    # skip every HIP-prefixed alias (HIP n, HIP nA, HIPASS ...), as before
+    return next((x for x in ids if not x.strip().upper().startswith("HIP")), None)
+
+def build_name_index(conn, hips):
+    """
+    Resolve every wanted HIP to its display name once, in a single scan of
+    the cache, so the write pass is a plain dict lookup per record.
+    """
+    name_by_hip = {}
+    for hip, main_id, ids in conn.execute("SELECT hip, main_id, ids FROM simbad"):
+        if hip not in hips:
+            continue
+        name_by_hip[hip] = pick_name(main_id, orjson.loads(ids) if not main_id and ids else [])
+    return name_by_hip
+
+def record_hip(rec):
+    """A record's 'hip' as an int, or None if missing or malformed."""
+    try:
+        return int(rec["hip"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def iter_records(path: Path):
+    """Yield one parsed record per non-blank NDJSON line, streaming from disk."""
+    with path.open("rb") as fh:
+        for ln in fh:
+            ln = ln.strip()
+            if ln:
+                yield orjson.loads(ln)
+
+def build_query(hip_list):
+    """
+    ADQL selecting MAIN_ID and the cross-identifications for every object
+    known under one of the given 'HIP <id>' names. The matched identifier
+    (ident.id) comes back on every row, so each row maps to exactly the HIP
+    that was asked for.
+    """
+    names = ",".join(f"'HIP {int(h)}'" for h in hip_list)
+    return ADQL_TEMPLATE.format(names=names)
+
+@retry(wait=wait_exponential(multiplier=RETRY_DELAY), stop=stop_after_attempt(RETRIES), reraise=True)
+async def post_tap(session, query):
+    async with session.post(TAP_URL, data={**TAP_FORM, "QUERY": query}) as resp:
+        resp.raise_for_status()
+        return orjson.loads(await resp.read())
+
+def tap_rows(result):
+    """Rows of a TAP JSON response as plain dicts keyed by column name."""
+    names = [col["name"] for col in result.get("metadata", [])]
+    return [dict(zip(names, row)) for row in result.get("data", [])]
+
+async def query_simbad_for_hips(session, hip_list):
+    """
+    Query SIMBAD TAP for a list of HIP ids.
+    Returns dict mapping 'HIP:<id>' -> {'main_id':..., 'ids':[...] }
+    """
+    result = await post_tap(session, build_query(hip_list))
+    requested = {int(h) for h in hip_list}
+    out = {}
+    for row in tap_rows(result):
+        main = row.get("main_id")
+        ids_raw = row.get("ids")
+        # ident.id is the queried name, e.g. 'HIP 32349'
+        hip = extract_hip(row.get("id"))
+        if hip not in requested:
+            continue
+        out[f"HIP:{hip}"] = {
+            "main_id": str(main) if main is not None else None,
+            "ids": split_ids(ids_raw)
+        }
+    return out
+
+async def lookup_all(conn, need, batch_size, concurrency, delay):
+    """
+    Fire all batches concurrently (at most `concurrency` in flight) over one
+    pooled keep-alive session, writing each finished batch to the cache.
+    Returns the list of failed batches.
+    """
+    sem = asyncio.Semaphore(concurrency)
+    chunks = [need[i:i+batch_size] for i in range(0, len(need), batch_size)]
+
+    async def fetch_batch(session, batch):
+        async with sem:
+            print(f"Querying SIMBAD for hips {batch[0]}..{batch[-1]} (count {len(batch)})")
+            try:
+                found = await query_simbad_for_hips(session, batch)
+                # HIPs without a row are unknown to SIMBAD; cache the miss so we don't requery
+                for h in batch:
+                    found.setdefault(f"HIP:{h}", {"main_id": None, "ids": []})
+                store_cache(conn, found)
+            finally:
+                # polite delay before this worker picks up the next batch
+                await asyncio.sleep(delay)
+
+    # one pooled session for every batch: TCP+TLS handshakes happen once per
+    # connection, not once per query
+    connector = aiohttp.TCPConnector(limit=16, keepalive_timeout=60, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=120)
+    headers = {"Connection": "keep-alive"}
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+        results = await asyncio.gather(*[fetch_batch(session, b) for b in chunks], return_exceptions=True)
+
+    failed = []
+    for batch, res in zip(chunks, results):
+        if isinstance(res, BaseException):
+            print(f"Error querying SIMBAD for hips {batch[0]}..{batch[-1]}: {res}")
+            failed.append(batch)
+    return failed
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", default="output/hipparcos.ndjson")
     parser.add_argument("--out", default="output/hipparcos.with_names.ndjson")
-    parser.add_argument("--cache", default="output/names_cache.json")
+    parser.add_argument("--cache", default="output/names_cache.sqlite")
     parser.add_argument("--sample", default="data/hipparcos_sample_named.ndjson")
     parser.add_argument("--sample-size", type=int, default=50)
     parser.add_argument("--delay", type=float, default=DELAY_S)
     parser.add_argument("--batch", type=int, default=BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
     args = parser.parse_args()
 
     input_path = Path(args.input)
@@ -102,123 +228,51 @@ def main():
         print("Input file not found:", input_path)
         return
 
-    cache = load_cache(cache_path)
-    print(f"Loaded cache entries: {len(cache)}")
-
-    lines = [l for l in input_path.read_text(encoding="utf8").splitlines() if l.strip()]
-    print("Total records:", len(lines))
+    conn = open_cache(cache_path)
+    print(f"Loaded cache entries: {conn.execute('SELECT COUNT(*) FROM simbad').fetchone()[0]}")
 
-    # gather HIP ids (expect 'hip' field per record)
-    records = []
-    hips = []
-    for ln in lines:
-        obj = json.loads(ln)
-        records.append(obj)
-        if "hip" in obj and obj["hip"] is not None:
-            hips.append(int(obj["hip"]))
+    # gather HIP ids (expect 'hip' field per record); records are streamed,
+    # never held in memory, and re-read for the enrichment pass below
+    total = 0
+    hips = set()
+    for obj in iter_records(input_path):
+        total += 1
+        hip = record_hip(obj)
+        if hip is not None:
+            hips.add(hip)
+    print("Total records:", total)
 
-    unique_hips = sorted(set(hips))
+    unique_hips = sorted(hips)
     print("HIPs:", len(unique_hips))
 
     # build list of hips needing lookup
-    need = [h for h in unique_hips if f"HIP:{h}" not in cache]
+    cached = {h for (h,) in conn.execute("SELECT hip FROM simbad")}
+    need = [h for h in unique_hips if h not in cached]
     print("HIPs to lookup (not cached):", len(need))
     if len(need) == 0:
         print("All HIPs cached. Augmenting records from cache...")
     else:
-        # batch query SIMBAD
-        for i in range(0, len(need), args.batch):
-            batch = need[i:i+args.batch]
-            print(f"Querying SIMBAD for hips {batch[0]}..{batch[-1]} (count {len(batch)})")
-            # Simbad expects 'HIP X' style names
-            qnames = [f"HIP {h}" for h in batch]
-            # perform query
-            try:
-                tbl = Simbad.query_objects(qnames)
-            except Exception as e:
-                print("Error querying SIMBAD:", e)
-                tbl = None
-
-            # If result is None, no matches for batch
-            if tbl is None:
-                # mark cache entries as None so we don't requery immediately
-                for h in batch:
-                    cache[f"HIP:{h}"] = {"main_id": None, "ids": []}
-            else:
-                # iterate rows: astroph query result has MAIN_ID and IDS
-                # NOTE: Simbad returns results in the same order for found objects; not necessarily all requested
-                for row in tbl:
-                    main = row.get("MAIN_ID")
-                    ids_raw = row.get("IDS")
-                    ids_list = []
-                    if ids_raw is not None:
-                        s = str(ids_raw)
-                        if "|" in s:
-                            ids_list = [t.strip() for t in s.split("|") if t.strip()]
-                        else:
-                            ids_list = [t.strip() for t in s.split(";") if t.strip()]
-                    # attempt to find HIP id in ids_list
-                    hip_key = None
-                    for token in ids_list:
-                        tok = token.replace(" ", "")
-                        if tok.upper().startswith("HIP"):
-                            try:
-                                hipnum = int(tok[3:])
-                                hip_key = f"HIP:{hipnum}"
-                                break
-                            except:
-                                pass
-                    # fallback: if no hip_key, try to find digits from MAIN_ID
-                    if hip_key is None:
-                        # try to parse digits at end
-                        hip_key = None
-
-                    # store in cache; if hip_key unresolved, put under MAIN_ID pseudo-key
-                    if hip_key is None:
-                        # try to attach for each requested hip that includes the same coordinate? fallback: assign to first requested
-                        # For robustness, assign to first requested HIP in batch (best-effort)
-                        hip_key = f"HIP:{batch[0]}"
-
-                    cache[hip_key] = {"main_id": str(main) if main is not None else None, "ids": ids_list}
-
-            # polite delay
-            time.sleep(args.delay)
-
-        # after querying all batches, save cache
-        save_cache(cache_path, cache)
-        print("Finished lookups. Cached:", len(cache))
-
-    # Now enrich original records using cache (lookup by HIP:<n>)
-    out_lines = []
-    for rec in records:
-        hip = rec.get("hip")
-        name = None
-        if hip is not None:
-            key = f"HIP:{int(hip)}"
-            c = cache.get(key)
-            if c:
-                # prefer main_id, else pick first IDS that isn't HIP
-                if c.get("main_id"):
-                    name = c.get("main_id")
-                else:
-                    ids = c.get("ids", [])
-                    # select non-HIP id if present
-                    alt = next((x for x in ids if not x.strip().upper().startswith("HIP")), None)
-                    name = alt or None
-        rec["name"] = name
-        out_lines.append(json.dumps(rec, ensure_ascii=False))
-
-    # write outputs
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    out_path.write_text("\n".join(out_lines) + "\n", encoding="utf8")
-    print("Saved NDJSON:", out_path)
+        # batch query SIMBAD concurrently
+        t0 = time.time()
+        failed = asyncio.run(lookup_all(conn, need, args.batch, args.concurrency, args.delay))
+        print(f"Queried {len(need)} HIPs in {time.time() - t0:.1f}s ({len(failed)} failed batches, retried next run)")
+        print(f"Finished lookups. Cached: {conn.execute('SELECT COUNT(*) FROM simbad').fetchone()[0]}")
 
-    # create small sample for dev
+    # Now enrich original records using cache (lookup by HIP), streaming
+    # straight to the output; the dev sample is the first few output lines
+    name_by_hip = build_name_index(conn, hips)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
     sample_path.parent.mkdir(parents=True, exist_ok=True)
-    sample_size = min(args.sample_size, len(out_lines))
-    sample_lines = out_lines[:sample_size]
-    sample_path.write_text("\n".join(sample_lines) + "\n", encoding="utf8")
+    with out_path.open("wb") as fout, sample_path.open("wb") as fsample:
+        for i, rec in enumerate(iter_records(input_path)):
+            rec["name"] = name_by_hip.get(record_hip(rec))
+            line = orjson.dumps(rec) + b"\n"
+            fout.write(line)
+            if i < args.sample_size:
+                fsample.write(line)
+    print("Saved NDJSON:", out_path)
     print("Saved sample:", sample_path)
+    conn.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
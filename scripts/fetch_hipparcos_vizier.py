@@ -1,21 +1,31 @@
 # scripts/fetch_hipparcos_vizier.py
-# Requires: pip install astroquery pandas tqdm numpy
-import os, json, sys
+# Requires: pip install astroquery pandas numpy orjson
+import os, sys, shutil
+import multiprocessing as mp
 from astroquery.vizier import Vizier
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
+import orjson
 
 OUTPUT_DIR = "output"
 NDJSON_OUT = os.path.join(OUTPUT_DIR, "hipparcos.ndjson")
 CSV_OUT = os.path.join(OUTPUT_DIR, "hipparcos.csv")
 SAMPLE_OUT = os.path.join("data", "hipparcos_sample.ndjson")
 SAMPLE_SIZE = 5000
+VIZIER_CACHE = os.path.join(OUTPUT_DIR, ".vizier_cache")
+MIN_SHARD_ROWS = 10000  # below this, a single writer beats pool start-up
+
+# VizieR numeric columns, cast once up front (float64 so published values and
+# derived quantities keep the precision the catalogue provides)
+NUMERIC_COLS = ['RAICRS','DEICRS','Plx','Vmag','BTmag','VTmag','B-V']
 
 def fetch_vizier():
-    Vizier.ROW_LIMIT = -1
+    # only request the columns normalize_and_compute uses
     cols = ['HIP','RAICRS','DEICRS','Plx','Vmag','BTmag','VTmag','B-V','SpType']
-    v = Vizier()
+    v = Vizier(columns=cols, row_limit=-1, timeout=300)
+    # keep responses on disk so repeat runs skip the download
+    os.makedirs(VIZIER_CACHE, exist_ok=True)
+    v.cache_location = VIZIER_CACHE
     print("Fetching Hipparcos main catalogue from VizieR...")
     try:
         if hasattr(v, 'get_catalogs'):
@@ -36,10 +46,19 @@ def fetch_vizier():
     return df
 
 def normalize_and_compute(df):
+    # one astype for the columns that are already numeric; anything else
+    # (strings, objects) is coerced so bad values become NaN instead of raising
+    cols = [c for c in NUMERIC_COLS if c in df.columns]
+    numeric = [c for c in cols if pd.api.types.is_numeric_dtype(df[c])]
+    df = df.astype({c: 'float64' for c in numeric})
+    for c in cols:
+        if c not in numeric:
+            df[c] = pd.to_numeric(df[c], errors='coerce').astype('float64')
+
     # RA/DEC robust selection
     if 'RAICRS' in df.columns and 'DEICRS' in df.columns:
-        df['ra'] = pd.to_numeric(df['RAICRS'], errors='coerce')
-        df['dec'] = pd.to_numeric(df['DEICRS'], errors='coerce')
+        df['ra'] = df['RAICRS']
+        df['dec'] = df['DEICRS']
     else:
         ra_cols = [c for c in df.columns if c.upper().startswith('RA')]
         de_cols = [c for c in df.columns if c.upper().startswith('DE')]
@@ -47,12 +66,12 @@ def normalize_and_compute(df):
         df['dec'] = pd.to_numeric(df[de_cols[0]], errors='coerce') if de_cols else pd.NA
 
     df['hip'] = df.get('HIP')
-    df['vmag'] = pd.to_numeric(df.get('Vmag'), errors='coerce')
-    df['plx'] = pd.to_numeric(df.get('Plx'), errors='coerce')  # mas
+    df['vmag'] = df['Vmag'] if 'Vmag' in df.columns else np.nan
+    df['plx'] = df['Plx'] if 'Plx' in df.columns else np.nan  # mas
 
     # B-V may not exist; handle safely
     if 'B-V' in df.columns:
-        df['bv'] = pd.to_numeric(df['B-V'], errors='coerce')
+        df['bv'] = df['B-V']
     else:
         df['bv'] = None
 
@@ -62,44 +81,75 @@ def normalize_and_compute(df):
     else:
         df['sp_type'] = None
 
-    df['dist_pc'] = df['plx'].apply(lambda p: 1000.0/p if pd.notna(p) and p>0 else None)
+    # vectorized over the whole column; NaN wherever inputs are missing/invalid
+    plx = df['plx'].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['dist_pc'] = np.where(plx > 0, 1000.0/plx, np.nan)
 
-    def compute_absmag(row):
-        d = row['dist_pc']; m = row['vmag']
-        if pd.notna(d) and pd.notna(m) and d>0:
-            return float(m - 5 * (np.log10(d) - 1))
-        return None
-    df['absmag'] = df.apply(compute_absmag, axis=1)
+    d = df['dist_pc'].to_numpy(dtype=float); m = df['vmag'].to_numpy(dtype=float)
+    mask = np.isfinite(d) & (d > 0) & np.isfinite(m)
+    absmag = np.full(len(df), np.nan)
+    absmag[mask] = m[mask] - 5 * (np.log10(d[mask]) - 1)
+    df['absmag'] = absmag
 
-    def bv_to_temp(bv):
-        try:
-            if pd.isna(bv) or bv is None:
-                return None
-            return float(4600 * (1.0/(0.92*bv + 1.7) + 1.0/(0.92*bv + 0.62)))
-        except: return None
-    df['temp_k'] = df['bv'].apply(bv_to_temp)
+    # Ballesteros B-V -> effective temperature
+    bv = df['bv'].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        temp = 4600 * (1.0/(0.92*bv + 1.7) + 1.0/(0.92*bv + 0.62))
+    temp[~np.isfinite(temp)] = np.nan
+    df['temp_k'] = temp
 
     keep = ['hip','ra','dec','dist_pc','vmag','plx','bv','sp_type','absmag','temp_k']
     df_out = df[[c for c in keep if c in df.columns or c in ['hip','ra','dec','dist_pc','vmag','plx','bv','sp_type','absmag','temp_k']]].copy()
     df_out = df_out.dropna(subset=['ra','dec','vmag'])
     return df_out
 
-def write_ndjson(df, path):
+def _json_default(obj):
+    return None if obj is pd.NA else str(obj)
+
+def _write_part(kind, df, path, header):
+    if kind == 'ndjson':
+        # to_dict unboxes numpy scalars to Python floats/ints; orjson writes the
+        # shortest round-trip repr and emits NaN as null
+        with open(path, 'wb') as fh:
+            for rec in df.to_dict('records'):
+                fh.write(orjson.dumps(rec, default=_json_default) + b"\n")
+    else:
+        df.to_csv(path, index=False, header=header)
+
+def write_sharded(df, path, kind, workers=None):
+    """
+    Serialize df as 'ndjson' or 'csv' to path. Large frames are split into
+    row shards written by a process pool, then concatenated in order.
+    """
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, 'w', encoding='utf8') as fh:
-        for _, row in tqdm(df.iterrows(), total=len(df), desc=os.path.basename(path)):
-            obj = {}
-            for c in df.columns:
-                val = row[c]
-                obj[c] = None if pd.isna(val) else (val.item() if hasattr(val, 'item') else val)
-            fh.write(json.dumps(obj) + "\\n")
+    workers = workers or os.cpu_count() or 1
+    n = max(1, min(workers, len(df) // MIN_SHARD_ROWS))
+    if n == 1:
+        _write_part(kind, df, path, True)
+        return
+
+    bounds = np.linspace(0, len(df), n + 1, dtype=int)
+    parts = [f"{path}.part{i}" for i in range(n)]
+    jobs = [(kind, df.iloc[lo:hi], part, i == 0) for i, (lo, hi, part) in enumerate(zip(bounds[:-1], bounds[1:], parts))]
+    with mp.Pool(n) as pool:
+        pool.starmap(_write_part, jobs)
+
+    with open(path, 'wb') as out:
+        for part in parts:
+            with open(part, 'rb') as fh:
+                shutil.copyfileobj(fh, out)
+            os.remove(part)
+
+def write_ndjson(df, path):
+    write_sharded(df, path, 'ndjson')
 
 def main():
     df = fetch_vizier()
     df2 = normalize_and_compute(df)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     print("Saving CSV:", CSV_OUT)
-    df2.to_csv(CSV_OUT, index=False)
+    write_sharded(df2, CSV_OUT, 'csv')
     print("Saving NDJSON:", NDJSON_OUT)
     write_ndjson(df2, NDJSON_OUT)
     os.makedirs('data', exist_ok=True)
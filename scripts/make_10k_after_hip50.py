@@ -1,10 +1,7 @@
-import os
-import json
-import random
-from math import log10
 from pathlib import Path
 
 import numpy as np
+import orjson
 
 # Config
 NUM_NEW = 10_000
@@ -15,120 +12,101 @@ INPUT_FALLBACK = Path("data/hipparcos_sample.ndjson")
 OUT_NEW = Path("data/hipparcos_10k_after_hip50.ndjson")
 OUT_AUG = Path("output/hipparcos_augmented.ndjson")
 
-np.random.seed(SEED)
-random.seed(SEED)
+rng = np.random.default_rng(SEED)
 
 
 def load_ndjson(path: Path):
     if not path.exists():
         return []
     out = []
-    with path.open("r", encoding="utf-8") as f:
+    with path.open("rb") as f:
         for ln in f:
             ln = ln.strip()
             if not ln:
                 continue
             try:
-                out.append(json.loads(ln))
+                out.append(orjson.loads(ln))
             except Exception as e:
                 print(f"warning: skipping bad json line: {e}")
     return out
 
 
 def ballesteros_temp_from_bv(bv):
-    # Ballesteros approximation (safe handling)
-    try:
-        bv = float(bv)
-    except Exception:
-        return None
-    if np.isnan(bv):
-        return None
-    try:
+    # Ballesteros approximation over an array of B-V (NaN where undefined)
+    bv = np.asarray(bv, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
         T = 4600.0 * (1.0 / (0.92 * bv + 1.7) + 1.0 / (0.92 * bv + 0.62))
-        return float(T)
-    except Exception:
-        return None
+    return np.where(np.isfinite(T), T, np.nan)
 
 
-def make_new_star_from_template(template: dict, new_hip: int):
+def template_field(templates, name):
+    # one column of the template records as floats, NaN where missing
+    vals = [t.get(name) for t in templates]
+    return np.array([np.nan if v is None else v for v in vals], dtype=float)
+
+
+def make_new_stars_from_templates(templates, template_idx, new_hips):
     # Template fields expected: ra, dec, dist_pc, vmag, plx, bv, sp_type
-    # We'll perturb values to produce a distinct but realistic-looking star.
-    # RA: uniform 0..360, Dec: -90..90, Dist: log-normal-ish, Vmag perturb, B-V perturb
-    # If template has missing values, we synthesize plausible ones.
-    tem_ra = template.get("ra")
-    tem_dec = template.get("dec")
-    tem_dist = template.get("dist_pc")
-    tem_vmag = template.get("vmag")
-    tem_plx = template.get("plx")
-    tem_bv = template.get("bv")
+    # templates[template_idx[i]] seeds the star numbered new_hips[i]. Values are
+    # perturbed to produce distinct but realistic-looking stars; every quantity
+    # is computed for all stars at once, missing template values are synthesized.
+    n = len(new_hips)
+    # template columns are built once per template (not per star), then gathered
+    tem_ra = template_field(templates, "ra")[template_idx]
+    tem_dec = template_field(templates, "dec")[template_idx]
+    tem_dist = template_field(templates, "dist_pc")[template_idx]
+    tem_vmag = template_field(templates, "vmag")[template_idx]
+    tem_bv = template_field(templates, "bv")[template_idx]
 
     # RA/Dec: either near template or random
-    if tem_ra is None:
-        ra = float(np.random.uniform(0.0, 360.0))
-    else:
-        ra = float((tem_ra + np.random.normal(0, 5.0)) % 360.0)
+    ra = np.where(np.isnan(tem_ra), rng.uniform(0.0, 360.0, n), (tem_ra + rng.normal(0, 5.0, n)) % 360.0)
+    dec = np.where(np.isnan(tem_dec), rng.uniform(-80.0, 80.0, n), np.clip(tem_dec + rng.normal(0, 3.0, n), -90.0, 90.0))
 
-    if tem_dec is None:
-        dec = float(np.random.uniform(-80.0, 80.0))
-    else:
-        dec = float(max(-90.0, min(90.0, tem_dec + np.random.normal(0, 3.0))))
-
-    # Distance: if known, perturb multiplicatively; else sample from a skewed distribution
-    if tem_dist and tem_dist > 0:
-        # log-normal perturbation
-        factor = float(10 ** np.random.normal(0, 0.25))
-        dist_pc = float(max(1.0, tem_dist * factor))
-    else:
-        # sample between 1 and 5000 (skew to nearer stars)
-        dist_pc = float(10 ** np.random.uniform(0, 3.7))  # 1..~5000
+    # Distance: if known, log-normal multiplicative perturbation; else sample
+    # between 1 and ~5000 pc (skew to nearer stars)
+    has_dist = np.nan_to_num(tem_dist) > 0
+    factor = 10 ** rng.normal(0, 0.25, n)
+    dist_pc = np.where(has_dist, np.maximum(1.0, tem_dist * factor), 10 ** rng.uniform(0, 3.7, n))
 
     # Parallax (mas). plx = 1000 / dist_pc
-    plx = float(1000.0 / dist_pc) if dist_pc > 0 else None
+    plx = 1000.0 / dist_pc
 
-    # Apparent magnitude: perturb template or sample
-    if tem_vmag is not None:
-        vmag = float(max(-2.0, tem_vmag + np.random.normal(0, 0.7)))
-    else:
-        # sample between 0 and 12, skewed toward fainter
-        vmag = float(np.random.normal(8.0, 2.5))
-        vmag = float(max(-2.0, min(18.0, vmag)))
+    # Apparent magnitude: perturb template or sample (skewed toward fainter)
+    vmag = np.where(
+        np.isnan(tem_vmag),
+        np.clip(rng.normal(8.0, 2.5, n), -2.0, 18.0),
+        np.maximum(-2.0, tem_vmag + rng.normal(0, 0.7, n)),
+    )
 
-    # B-V color: perturb or sample
-    if tem_bv is not None:
-        bv = float(tem_bv + np.random.normal(0, 0.15))
-    else:
-        bv = float(np.random.normal(0.65, 0.5))
-    # clamp plausible range
-    if bv is None or np.isnan(bv):
-        bv = None
-    else:
-        bv = float(max(-0.5, min(2.0, bv)))
+    # B-V color: perturb or sample, clamped to a plausible range
+    bv = np.where(np.isnan(tem_bv), rng.normal(0.65, 0.5, n), tem_bv + rng.normal(0, 0.15, n))
+    bv = np.clip(bv, -0.5, 2.0)
 
-    # Absolute magnitude M = m - 5*(log10(d) - 1) if dist known
-    absmag = None
-    try:
-        if dist_pc and dist_pc > 0 and vmag is not None:
-            absmag = float(vmag - 5.0 * (log10(dist_pc) - 1.0))
-    except Exception:
-        absmag = None
+    # Absolute magnitude M = m - 5*(log10(d) - 1)
+    absmag = vmag - 5.0 * (np.log10(dist_pc) - 1.0)
 
     # Temperature from B-V
     temp_k = ballesteros_temp_from_bv(bv)
 
-    # Build record
-    rec = {
-        "hip": int(new_hip),
-        "ra": float(ra),
-        "dec": float(dec),
-        "dist_pc": float(dist_pc) if dist_pc is not None else None,
-        "vmag": float(vmag) if vmag is not None else None,
-        "plx": float(plx) if plx is not None else None,
-        "bv": float(bv) if bv is not None else None,
-        "sp_type": None,
-        "absmag": float(absmag) if absmag is not None else None,
-        "temp_k": float(temp_k) if temp_k is not None else None,
-    }
-    return rec
+    # Build records (NaN is written as null)
+    return [
+        {
+            "hip": int(h),
+            "ra": r,
+            "dec": de,
+            "dist_pc": d,
+            "vmag": v,
+            "plx": p,
+            "bv": c,
+            "sp_type": None,
+            "absmag": m,
+            "temp_k": t,
+        }
+        for h, r, de, d, v, p, c, m, t in zip(
+            new_hips, ra.tolist(), dec.tolist(), dist_pc.tolist(), vmag.tolist(),
+            plx.tolist(), bv.tolist(), absmag.tolist(), temp_k.tolist(),
+        )
+    ]
 
 
 def main():
@@ -155,12 +133,10 @@ def main():
     print(f"Loaded {len(base)} source stars (unique HIPs: {len(existing_hips)})")
 
     # Determine starting HIP candidate
-    new_records = []
-    next_hip = START_AFTER_HIP + 1  # start trying from 51
+    new_hips = []
     created = 0
     max_iterations = NUM_NEW * 5  # guard
     iter_count = 0
-    hips_tried = set()
 
     # pool for templates
     templates = list(existing_by_hip.values())
@@ -178,31 +154,32 @@ def main():
         if hip_candidate in existing_hips:
             continue  # skip collision
 
-        # create new star
-        tpl = random.choice(templates)
-        new_rec = make_new_star_from_template(tpl, hip_candidate)
-        new_records.append(new_rec)
+        # reserve hip number; stars are generated in one go below
+        new_hips.append(hip_candidate)
         existing_hips.add(hip_candidate)
         created += 1
 
+    # pick a template for every new star in a single draw
+    template_idx = rng.integers(0, len(templates), size=len(new_hips))
+    new_records = make_new_stars_from_templates(templates, template_idx, new_hips)
     print(f"Created {created} new synthetic stars (attempts: {iter_count})")
 
     # write new-only file
     OUT_NEW.parent.mkdir(parents=True, exist_ok=True)
-    with OUT_NEW.open("w", encoding="utf-8") as f:
+    with OUT_NEW.open("wb") as f:
         for r in new_records:
-            f.write(json.dumps(r) + "\n")
+            f.write(orjson.dumps(r) + b"\n")
     print(f"Wrote {len(new_records)} new records to {OUT_NEW}")
 
     # write augmented file (original + appended)
     OUT_AUG.parent.mkdir(parents=True, exist_ok=True)
-    with OUT_AUG.open("w", encoding="utf-8") as f:
+    with OUT_AUG.open("wb") as f:
         # write originals (from input source)
         for r in base:
-            f.write(json.dumps(r) + "\n")
+            f.write(orjson.dumps(r) + b"\n")
         # write new
         for r in new_records:
-            f.write(json.dumps(r) + "\n")
+            f.write(orjson.dumps(r) + b"\n")
     print(f"Wrote augmented catalogue (original + new) to {OUT_AUG}")
 
     print("Done. If you want to tile these, run your tiling script on the augmented file.")
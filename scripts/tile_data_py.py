@@ -1,48 +1,87 @@
-import os, json, gzip, math
-from collections import defaultdict
+import os, gzip
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import repeat
+
+import numpy as np
+import orjson
 
 INFILE = "output/hipparcos.ndjson"
 OUTDIR = "data/tiles"
 TILE_DEG = 4.0
+GZIP_LEVEL = 6  # ~3x faster than the default 9 for a few % larger files
+WRITE_PLAIN = False  # also write uncompressed <key>.ndjson next to each .gz
+
+def iter_records(path):
+    """Yield parsed records from an NDJSON file, skipping blank/bad lines."""
+    with open(path, "rb") as fh:
+        for ln in fh:
+            ln = ln.strip()
+            if not ln:
+                continue
+            try:
+                yield orjson.loads(ln)
+            except Exception:
+                continue
 
-os.makedirs(OUTDIR, exist_ok=True)
-
-# read lines
-with open(INFILE, "r", encoding="utf8") as fh:
-    lines = [ln.strip() for ln in fh if ln.strip()]
-
-print(f"Read {len(lines)} stars from {INFILE}")
-
-tiles = defaultdict(list)
-for ln in lines:
-    try:
-        obj = json.loads(ln)
-    except Exception:
-        continue
-    ra = obj.get("ra")
-    dec = obj.get("dec")
-    if ra is None or dec is None:
-        continue
-    try:
-        ra = float(ra); dec = float(dec)
-    except Exception:
-        continue
-    tx = int(math.floor(((ra % 360) + 360) % 360 / TILE_DEG))
-    ty = int(math.floor((dec + 90.0) / TILE_DEG))
-    key = f"{tx}_{ty}"
-    tiles[key].append(obj)
-
-print(f"Preparing to write {len(tiles)} tiles to {OUTDIR} ...")
-written = 0
-for key, arr in tiles.items():
-    plain = "\n".join(json.dumps(x, default=str) for x in arr) + "\n"
-    path_plain = os.path.join(OUTDIR, f"{key}.ndjson")
-    with open(path_plain, "w", encoding="utf8") as fh:
-        fh.write(plain)
-    # gzip
+def write_tile(key, arr, outdir):
+    """Stream one tile's records through gzip (and the plain file if enabled); runs in a worker."""
+    path_plain = os.path.join(outdir, f"{key}.ndjson")
     path_gz = path_plain + ".gz"
-    with gzip.open(path_gz, "wb") as gzfh:
-        gzfh.write(plain.encode("utf8"))
-    written += 1
+    with gzip.open(path_gz, "wb", compresslevel=GZIP_LEVEL) as gzfh, \
+            (open(path_plain, "wb") if WRITE_PLAIN else nullcontext()) as fh:
+        for x in arr:
+            line = orjson.dumps(x, default=str) + b"\n"
+            gzfh.write(line)
+            if fh is not None:
+                fh.write(line)
+    return key
+
+def main():
+    os.makedirs(OUTDIR, exist_ok=True)
+
+    # stream records in, keeping only those with usable coordinates
+    count = 0
+    recs, ras, decs = [], [], []
+    for obj in iter_records(INFILE):
+        count += 1
+        ra = obj.get("ra")
+        dec = obj.get("dec")
+        if ra is None or dec is None:
+            continue
+        try:
+            ra = float(ra); dec = float(dec)
+        except Exception:
+            continue
+        recs.append(obj); ras.append(ra); decs.append(dec)
+
+    # tile indices for every star in one vectorized pass
+    ra = np.asarray(ras, dtype=np.float64)
+    dec = np.asarray(decs, dtype=np.float64)
+    tx = np.floor(((ra % 360) + 360) % 360 / TILE_DEG).astype(np.int32)
+    ty = np.floor((dec + 90.0) / TILE_DEG).astype(np.int32)
+
+    # group by tile with one stable sort: each tile is a contiguous run of
+    # the sorted order, so no per-record dict hashing or list appends
+    keys = tx.astype(np.int64) * 1000 + ty
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    groups = np.split(order, np.flatnonzero(np.diff(sorted_keys)) + 1) if len(order) else []
+    tile_keys = []
+    tile_recs = []
+    for idx in groups:
+        k = int(keys[idx[0]])
+        tile_keys.append(f"{k // 1000}_{k % 1000}")
+        tile_recs.append([recs[i] for i in idx.tolist()])
+
+    print(f"Read {count} stars from {INFILE}")
+
+    # serialization + gzip is CPU-bound; spread tiles over all cores
+    print(f"Preparing to write {len(tile_keys)} tiles to {OUTDIR} ...")
+    with ProcessPoolExecutor() as ex:
+        written = sum(1 for _ in ex.map(write_tile, tile_keys, tile_recs, repeat(OUTDIR), chunksize=8))
+
+    print(f"Wrote {written} tiles to {OUTDIR}")
 
-print(f"Wrote {written} tiles to {OUTDIR}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()